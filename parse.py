@@ -1,85 +1,269 @@
 import argparse
+import contextlib
 import json
+import logging
+import logging.handlers
+import mmap
+import multiprocessing
 import os
 import re
+import shelve
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Any
 
 from pypdf import PdfReader
 
-date_regex = re.compile(r"Schlusstag\s*(\d{2}\.\d{2}\.\d{4})")
-date_time_regex = re.compile(r"Schlusstag/-Zeit\s*(\d{2}\.\d{2}\.\d{4}\s+\d{2}:\d{2}:\d{2})")
-isin_regex = re.compile(r"((IE|US|CA|CH|GB|AU|KY)\w{10})")
-pieces_regex = re.compile(r"Stück\s*(\d+)(?:,(\d+))?")
-price_regex = re.compile(r"Ausführungskurs\s*(\d+),(\d+)\s+EUR")
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
 
-def generate_dkb_trade_data(input_directory: str, output_file: str, ignored_symbols, merge: bool) -> None:
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+trade_field_patterns = [
+    ("date_time", r"Schlusstag/-Zeit\s*(?P<date_time_value>\d{2}\.\d{2}\.\d{4}\s+\d{2}:\d{2}:\d{2})"),
+    ("date", r"Schlusstag\s*(?P<date_value>\d{2}\.\d{2}\.\d{4})"),
+    ("pieces", r"Stück\s*(?P<pieces_value>\d+(?:,\d+)?)"),
+    ("price", r"Ausführungskurs\s*(?P<price_value>\d+,\d+)\s+EUR"),
+    # Zero-width so an ISIN hit never consumes text that could start another field
+    ("isin", r"(?=(?P<isin_value>(?:IE|US|CA|CH|GB|AU|KY)\w{10}))"),
+]
+trade_regex = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in trade_field_patterns))
+trade_file_regex = re.compile(r"^(Kauf|Verkauf)_.*Wertpapierabrechnung.*\.pdf$")
+required_trade_fields = ("date_time", "pieces", "price", "isin")
+
+# Number of characters read from the start of the page before falling back to the full page
+text_prefix_chars = 4096
+# Matches ending this close to the end of a prefix might be cut off and are not trusted
+text_prefix_margin = 64
+
+# Part of the trade cache key; bump whenever extraction or parsing changes so cached trades are redone
+trade_parser_version = 1
+
+def _find_trade_fields(text: str) -> dict[str, re.Match]:
+    """
+    Finds the first match of every trade field in a single pass over the text.
+    """
+    fields = {}
+    for match in trade_regex.finditer(text):
+        fields.setdefault(match.lastgroup, match)
+    return fields
+
+
+def _find_trade_fields_in_prefix(text: str) -> dict[str, re.Match] | None:
+    """
+    Finds the trade fields in a page prefix, or returns None if the full page is needed.
+    """
+    fields = _find_trade_fields(text)
+    if any(name not in fields for name in required_trade_fields):
+        return None
+    if any(match.end(f"{name}_value") > len(text) - text_prefix_margin for name, match in fields.items()):
+        return None
+    return fields
+
+
+def _extract_first_page_fields(joined_path: str) -> dict[str, re.Match]:
+    """
+    Extracts the trade fields of the first page, using PDFium if available and pypdf otherwise.
+    With PDFium only the start of the page is read if it already contains all fields.
+    """
+    if pypdfium2 is not None:
+        with (
+            pypdfium2.PdfDocument(joined_path) as pdf,
+            contextlib.closing(pdf[0]) as page,
+            contextlib.closing(page.get_textpage()) as textpage,
+        ):
+            if textpage.count_chars() > text_prefix_chars:
+                fields = _find_trade_fields_in_prefix(textpage.get_text_range(count=text_prefix_chars))
+                if fields is not None:
+                    return fields
+            return _find_trade_fields(textpage.get_text_range())
+    with open(joined_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return _find_trade_fields(PdfReader(mapped).pages[0].extract_text())
+
+
+def _init_worker(log_queue: multiprocessing.Queue) -> None:
+    """
+    Routes the log records of a worker process through a queue to the main process.
+    """
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+
+
+def _extract_one(joined_path: str, trade_type: str) -> dict[str, Any] | None:
+    """
+    Extracts a single trade from a DKB PDF. Runs in a worker process.
+    """
+    logger.info("Processing %s...", joined_path)
+    fields = _extract_first_page_fields(joined_path)
+    trade = _trade_from_fields(fields)
+
+    if trade is None:
+        return None
+
+    trade["type"] = trade_type
+    return trade
+
+
+def generate_dkb_trade_data(
+    input_directory: str, output_file: str, ignored_symbols: frozenset[str], merge: bool, cache: bool = False
+) -> None:
     """
     Extracts trade data from DKB PDFs and saves it to a JSON file.
+    With cache set, extracted trades are kept next to the output file and reused for unchanged PDFs.
     """
-    if merge and os.path.exists(output_file):
-        with open(output_file) as f:
+    processed_file = f"{os.path.splitext(output_file)[0]}.processed.json"
+    # shelve lets the dbm backend pick the actual file names, which all start with this prefix
+    cache_file = f"{os.path.splitext(output_file)[0]}.cache"
+    processed: set[str] = set()
+    existing = merge and os.path.exists(output_file)
+    if existing and os.path.exists(processed_file):
+        with open(processed_file) as f:
+            processed = set(json.load(f))
+
+    names = []
+    paths = []
+    trade_types = []
+    cache_keys = []
+    with os.scandir(input_directory) as entries:
+        for entry in entries:
+            if entry.name in processed:
+                logger.info("Skipping already processed %s...", entry.path)
+            elif match := trade_file_regex.match(entry.name):
+                names.append(entry.name)
+                paths.append(entry.path)
+                trade_types.append("BUY" if match.group(1) == "Kauf" else "SELL")
+                stat = entry.stat()
+                cache_keys.append(
+                    f"{trade_parser_version}:{os.path.abspath(entry.path)}:{stat.st_mtime_ns}:{stat.st_size}"
+                )
+            elif entry.name.endswith(".pdf"):
+                logger.info("Skipping %s...", entry.path)
+
+    # Leave a large merge file untouched when there is nothing new to add to it
+    if existing and not paths:
+        logger.info("No new trade files for %s", output_file)
+        return
+
+    if existing:
+        with open(output_file, encoding="utf-8") as f:
             data = json.load(f)
     else:
         data = {
             "activities": [],
         }
-    for file in os.listdir(input_directory):
-        joined_path = os.path.join(input_directory, file)
-        if file.endswith(".pdf"):
-            if file.startswith("Kauf_") and "Wertpapierabrechnung" in file:
-                trade_type = "BUY"
-            elif file.startswith("Verkauf_") and "Wertpapierabrechnung" in file:
-                trade_type = "SELL"
-            else:
-                print(f"Skipping {joined_path}...")
-                continue
-            print(f"Processing {joined_path}...")
-            pdf = PdfReader(joined_path)
-            text = pdf.pages[0].extract_text()
-            trade = parse_trade_data(text)
-
-            if trade is None:
-                continue
-
-            trade["type"] = trade_type
-            symbol = trade["symbol"]
-
-            if symbol in ignoredsymbols:
-                print(f"Skipped ignored symbol {symbol}")
-                continue
-
-            for existing_trade in data["activities"]:
-                if existing_trade["date"] == trade["date"]:
-                    print(f"Skipping duplicate trade on {trade['date']} to {symbol}...")
-                    break
+    seen_dates: set[str] = {a["date"] for a in data["activities"]}
+
+    with shelve.open(cache_file) if cache else contextlib.nullcontext({}) as trade_cache:
+        trades = [None] * len(paths)
+        misses = []
+        for i, key in enumerate(cache_keys):
+            if key in trade_cache:
+                logger.info("Using cached %s...", paths[i])
+                trades[i] = trade_cache[key]
             else:
-                data["activities"].append(trade)
-                print(f"Added trade on {trade['date']} to {symbol}")
+                misses.append(i)
+
+        if misses:
+            log_queue = multiprocessing.Queue()
+            listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+            with ProcessPoolExecutor(initializer=_init_worker, initargs=(log_queue,)) as executor:
+                extracted = executor.map(
+                    _extract_one,
+                    [paths[i] for i in misses],
+                    [trade_types[i] for i in misses],
+                    chunksize=4,
+                )
+                # map() submits every task and so starts the workers; only now start the listener thread,
+                # so workers are never forked from a multi-threaded process
+                listener.start()
+                try:
+                    for i, trade in zip(misses, extracted):
+                        # Failed extractions are not cached so they are retried on the next run
+                        if trade is not None:
+                            trade_cache[cache_keys[i]] = trade
+                        trades[i] = trade
+                    # Wait for the workers so their last log records reach the listener
+                    executor.shutdown()
+                finally:
+                    listener.stop()
+
+    added = 0
+    for name, trade in zip(names, trades):
+        if trade is None:
+            continue
+
+        symbol = trade["symbol"]
 
-    with open(output_file, "w") as f:
-        json.dump(data, f, indent=2, sort_keys=True)
+        if symbol in ignored_symbols:
+            logger.info("Skipped ignored symbol %s", symbol)
+            continue
+
+        processed.add(name)
+        if trade["date"] in seen_dates:
+            logger.info("Skipping duplicate trade on %s to %s...", trade["date"], symbol)
+            continue
+
+        seen_dates.add(trade["date"])
+        data["activities"].append(trade)
+        added += 1
+        logger.info("Added trade on %s to %s", trade["date"], symbol)
+
+    if existing and not added:
+        logger.info("No new trades for %s", output_file)
+    elif orjson is not None:
+        with open(output_file, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+    else:
+        # Raw UTF-8 like orjson; float formatting can still differ between the two writers
+        with open(output_file, "w", encoding="utf-8", buffering=1 << 20) as f:
+            f.write(json.dumps(data, indent=2, sort_keys=True, ensure_ascii=False))
+
+    # Trade files already in the output, so merging runs can skip them without opening the PDF
+    with open(processed_file, "w") as f:
+        json.dump(sorted(processed), f, indent=2)
+
+
+def _fast_parse(value: str) -> datetime:
+    """
+    Parses a "dd.mm.yyyy" date with an optional "HH:MM:SS" time by slicing the fixed-width digits.
+    """
+    day, month, year = int(value[0:2]), int(value[3:5]), int(value[6:10])
+    if len(value) > 10:
+        time = value[-8:]
+        return datetime(year, month, day, int(time[0:2]), int(time[3:5]), int(time[6:8]))
+    return datetime(year, month, day)
 
 
 def parse_trade_data(text: str) -> dict[str, Any]:
-    isin_match = re.search(isin_regex, text)
+    return _trade_from_fields(_find_trade_fields(text))
+
+
+def _trade_from_fields(fields: dict[str, re.Match]) -> dict[str, Any]:
+    isin_match = fields.get("isin")
     if isin_match is None:
-        print(f"Skipping invalid isin")
+        logger.info("Skipping invalid isin")
         return None
-    isin = isin_match.group(1)
-    date_and_time = re.search(date_time_regex, text)
-    if date_and_time:
-        parsed_datetime = datetime.strptime(date_and_time.group(1), "%d.%m.%Y %H:%M:%S")
-    elif re.search(date_regex, text):
-        date = re.search(date_regex, text).group(1)
-        parsed_datetime = datetime.strptime(date, "%d.%m.%Y")
+    isin = isin_match.group("isin_value")
+    if date_and_time := fields.get("date_time"):
+        parsed_datetime = _fast_parse(date_and_time.group("date_time_value"))
+    elif date := fields.get("date"):
+        parsed_datetime = _fast_parse(date.group("date_value"))
     else:
-        print(f"Skipped {isin} because of missing date")
+        logger.info("Skipped %s because of missing date", isin)
         return None
-    pieces = re.search(pieces_regex, text)
-    parsed_pieces = float(pieces.group(1)) + (float(f"0.{pieces.group(2)}") if pieces.group(2) else 0)
-    price = re.search(price_regex, text)
-    parsed_price = float(price.group(1)) + (float(f"0.{price.group(2)}") if price.group(2) else 0)
+    pieces = fields["pieces"]
+    parsed_pieces = float(pieces.group("pieces_value").replace(",", "."))
+    price = fields["price"]
+    parsed_price = float(price.group("price_value").replace(",", "."))
     return {
         "accountId": "e2a4628f-1146-4ab8-b559-6058c7657bbb",
         "comment": "",
@@ -121,10 +305,22 @@ if __name__ == "__main__":
         default="ignored_symbols.json",
         help="File containing symbols to ignore",
     )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        action="store_true",
+        help="Cache extracted trades next to the output file and reuse them for unchanged PDFs",
+    )
     args = parser.parse_args()
 
-    ignored_symbols = []
+    # Buffer log output and write it in batches instead of once per message
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(message)s",
+        handlers=[logging.handlers.MemoryHandler(capacity=10000, target=logging.StreamHandler(sys.stdout))],
+    )
+
     with open(args.ignored_symbols, "r") as f:
-        ignoredsymbols = json.load(f)
+        ignored_symbols = frozenset(json.load(f))
 
-    generate_dkb_trade_data(args.input_directory, args.output_file, ignored_symbols, args.merge)
+    generate_dkb_trade_data(args.input_directory, args.output_file, ignored_symbols, args.merge, args.cache)
@@ -2,5 +2,5 @@ let
   pkgs = import <nixpkgs> {};
 in
 pkgs.mkShell {
-  buildInputs = with pkgs; [ (python311.withPackages(ps: with ps; [ pypdf ])) ];
+  buildInputs = with pkgs; [ (python311.withPackages(ps: with ps; [ pypdf pypdfium2 orjson ])) ];
 }
@@ -0,0 +1,42 @@
+import unittest
+from datetime import datetime
+
+from parse import _fast_parse, parse_trade_data
+
+trade_fields = " Schlusstag 06.02.2023 Stück 10 Ausführungskurs 150,5 EUR"
+
+
+class ParseTradeDataTest(unittest.TestCase):
+    def test_isin_glued_to_preceding_word(self):
+        trade = parse_trade_data("...U.ETFIE00B4L5Y983 (A0RPWH)" + trade_fields)
+        self.assertEqual(trade["symbol"], "IE00B4L5Y983")
+
+    def test_isin_glued_to_following_character(self):
+        trade = parse_trade_data("IE00B4L5Y983_" + trade_fields)
+        self.assertEqual(trade["symbol"], "IE00B4L5Y983")
+
+    def test_isin_like_junk_does_not_swallow_keyword(self):
+        trade = parse_trade_data("Kauf US0378331005 Schlusstag 06.02.2023 Stück 10 GBxxAusführungskurs\n 12,34 EUR")
+        self.assertEqual(trade["symbol"], "US0378331005")
+        self.assertEqual(trade["unitPrice"], 12.34)
+
+
+class FastParseTest(unittest.TestCase):
+    def test_date(self):
+        self.assertEqual(_fast_parse("05.01.2023"), datetime.strptime("05.01.2023", "%d.%m.%Y"))
+
+    def test_date_and_time(self):
+        self.assertEqual(
+            _fast_parse("05.01.2023 09:04:12"),
+            datetime.strptime("05.01.2023 09:04:12", "%d.%m.%Y %H:%M:%S"),
+        )
+
+    def test_date_and_time_with_wide_whitespace(self):
+        self.assertEqual(
+            _fast_parse("31.12.1999 \n 23:59:58"),
+            datetime.strptime("31.12.1999 \n 23:59:58", "%d.%m.%Y %H:%M:%S"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()